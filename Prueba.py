@@ -1,213 +1,454 @@
 import tclab 
 import numpy as np
+import os
+import sys
 import time
+import queue
+import threading
+import matplotlib
+
+# Sin pantalla (o con --no-gui) se usa el backend Agg: sin ventana ni gráfica en vivo,
+# solo se guarda la imagen final. Debe elegirse antes de importar pyplot
+HEADLESS = '--no-gui' in sys.argv or (
+    sys.platform.startswith('linux')
+    and os.environ.get('DISPLAY') is None
+    and os.environ.get('WAYLAND_DISPLAY') is None)
+if HEADLESS:
+    matplotlib.use('Agg')
+
 import matplotlib.pyplot as plt
-import pandas as pd
 from datetime import datetime
+from numba import njit
+
+# ------------------------------------------------------------------------------
+# Pasos del controlador compilados con Numba, uno por tipo de controlador
+# Reciben las ganancias ya combinadas: Kp = Kc, Ki = Kc*Ts/tauI, Kd = Kc*tauD/Ts
+# El derivativo se calcula sobre la medición (-dT) y se filtra con un pasa-bajos
+# de primer orden: d_f = alpha*d_f + (1 - alpha)*(-(T - prev_T))
+# Todos retornan (q, ierr, d_f, P, I, D)
+@njit(cache=True)
+def _step_pd(err, T, prev_T, ierr, d_f, Kp, Ki, Kd, alpha, Q_bias=0.0):
+    """
+    Calcula un paso del controlador PD (sin término integral)
+    """
+    P = Kp * err
+    d_f = alpha * d_f + (1.0 - alpha) * (-(T - prev_T))
+    D = Kd * d_f
+    
+    # Saturación sin ramas (no hay integral que corregir)
+    q = min(100.0, max(0.0, Q_bias + P + D))
+    
+    return q, ierr, d_f, P, 0.0, D
+
+@njit(cache=True)
+def _step_pi(err, T, prev_T, ierr, d_f, Kp, Ki, Kd, alpha, Q_bias=0.0):
+    """
+    Calcula un paso del controlador PI con anti-windup por integración condicional
+    """
+    P = Kp * err
+    I = Ki * (ierr + err)
+    u = Q_bias + P + I
+    
+    # Saturación sin ramas; solo se integra el error si la salida no se saturó
+    q = min(100.0, max(0.0, u))
+    ierr += err * (q == u)
+    
+    return q, ierr, d_f, P, I, 0.0
+
+@njit(cache=True)
+def _step_pid(err, T, prev_T, ierr, d_f, Kp, Ki, Kd, alpha, Q_bias=0.0):
+    """
+    Calcula un paso del controlador PID con anti-windup por integración condicional
+    """
+    P = Kp * err
+    I = Ki * (ierr + err)
+    d_f = alpha * d_f + (1.0 - alpha) * (-(T - prev_T))
+    D = Kd * d_f
+    u = Q_bias + P + I + D
+    
+    # Saturación sin ramas; solo se integra el error si la salida no se saturó
+    q = min(100.0, max(0.0, u))
+    ierr += err * (q == u)
+    
+    return q, ierr, d_f, P, I, D
+
+# Paso del controlador según su tipo
+PASOS = {'PD': _step_pd, 'PI': _step_pi, 'PID': _step_pid}
+
+# ------------------------------------------------------------------------------
+# Ajuste de límites para la gráfica en vivo
+def _ajustar_ylim(ax, series, idx):
+    """
+    Amplía los límites en y del eje solo si los datos graficados (índices idx) se salen de ellos
+    Retorna True si los límites cambiaron (hay que redibujar el fondo)
+    """
+    ymin = min(datos[idx].min() for _, datos in series)
+    ymax = max(datos[idx].max() for _, datos in series)
+    lim_inf, lim_sup = ax.get_ylim()
+    if lim_inf <= ymin and ymax <= lim_sup:
+        return False
+    margen = 0.05 * (ymax - ymin) or 1.0
+    ax.set_ylim(ymin - margen, ymax + margen)
+    return True
+
+# ------------------------------------------------------------------------------
+# Índices a graficar en vivo con un número de puntos acotado
+def _indices_graficar(i, ventana):
+    """
+    Índices de las muestras 0..i a graficar: las últimas `ventana` muestras completas
+    y el historial anterior submuestreado a lo sumo a `ventana` puntos
+    """
+    inicio = max(0, i + 1 - ventana)
+    paso = inicio // ventana + 1
+    return np.r_[0:inicio:paso, inicio:i+1]
+
+# ------------------------------------------------------------------------------
+# Figura en vivo: temperaturas arriba, PWM y componentes del controlador abajo
+def _crear_figura(tipo_controlador, t_max, T1, T2, SP1, Q1, componentes):
+    """
+    Crea la figura y sus líneas (animadas, para el blitting) sin datos
+    componentes: lista de (datos, estilo, etiqueta) de los componentes a graficar
+    Retorna (fig, ax1, ax2, series_temp, series_pwm); series_pwm empieza por Q1
+    """
+    fig, (ax1, ax2) = plt.subplots(2, 1)
+    
+    # Gráfica de temperatura
+    linea_T1, = ax1.plot([], [], 'r-', label='T1', animated=True)
+    linea_T2, = ax1.plot([], [], 'b-', label='T2', animated=True)
+    linea_SP, = ax1.plot([], [], 'k--', label='SP', animated=True)
+    ax1.set_ylabel('Temperatura (°C)')
+    ax1.set_title(f'Control {tipo_controlador} de Temperatura')
+    ax1.grid(True)
+    ax1.legend()
+    series_temp = [(linea_T1, T1), (linea_T2, T2), (linea_SP, SP1)]
+    
+    # Gráfica de PWM (Q1) y componentes del controlador
+    linea_Q1, = ax2.plot([], [], 'b-', label='Q1 (PWM)', animated=True)
+    series_pwm = [(linea_Q1, Q1)]
+    for datos, estilo, etiqueta in componentes:
+        linea, = ax2.plot([], [], estilo, label=etiqueta, animated=True)
+        series_pwm.append((linea, datos))
+    
+    ax2.set_ylabel('PWM (%)')
+    ax2.set_title('Señal de control Q1')
+    ax2.set_xlabel('Tiempo (s)')
+    ax2.grid(True)
+    ax2.legend()
+    
+    for ax in (ax1, ax2):
+        ax.set_xlim(0, t_max)  # t_max > 0 aun con una sola muestra
+    ax2.set_ylim(-10, 110)  # Límites fijos del PWM: el fondo no se redibuja por este eje
+    fig.tight_layout()
+    
+    return fig, ax1, ax2, series_temp, series_pwm
+
+# ------------------------------------------------------------------------------
+# Publicar un cuadro para la gráfica descartando el anterior si no se ha dibujado
+def _publicar(cola, dato):
+    """
+    Coloca dato en la cola (maxsize=1) sin bloquear al hilo de control
+    Si la cola está llena se reemplaza el cuadro viejo por el nuevo
+    """
+    try:
+        cola.put_nowait(dato)
+    except queue.Full:
+        try:
+            cola.get_nowait()
+        except queue.Empty:
+            pass
+        cola.put_nowait(dato)
 
 # ------------------------------------------------------------------------------
 # Función para permitir seleccionar el tipo de controlador
-def ejecutar_control(tipo_controlador='PID'):
+def ejecutar_control(tipo_controlador='PID', n=600, sample_period=1.0, window=120,
+                     retornar_df=True, save_plot=True, save_csv=True):
     """
     Ejecuta el control de temperatura con el tipo de controlador seleccionado
     tipo_controlador: 'PD', 'PI', o 'PID'
+    n: número de muestras
+    sample_period: periodo de muestreo en segundos
+    window: muestras recientes que se grafican en vivo a resolución completa
+    retornar_df: si es True retorna un DataFrame de pandas con los resultados
+    save_plot: si es True guarda la gráfica final como imagen PNG
+    save_csv: si es True guarda los datos en un archivo CSV
     """
-    lab = tclab.TCLab()
+    # Validar los parámetros antes de abrir la conexión con el laboratorio
+    if n < 1:
+        raise ValueError(f"n debe ser al menos 1 (se recibió {n})")
+    if sample_period <= 0:
+        raise ValueError(f"sample_period debe ser positivo (se recibió {sample_period})")
+    if window < 1:
+        raise ValueError(f"window debe ser al menos 1 (se recibió {window})")
     
     # Parámetros de control
     Kc = 24.4653  # Ganancia proporcional
     tauI =  99.9936  # Tiempo integral
     tauD = 19.6913  # Tiempo derivativo
+    Ki = Kc / tauI * sample_period  # Ganancia integral por muestra (precalculada)
+    Kd = Kc * tauD / sample_period  # Ganancia derivativa por muestra (precalculada)
+    Tf = tauD / 10.0  # Constante de tiempo del filtro derivativo
+    alpha = Tf / (Tf + sample_period)  # Coeficiente del filtro pasa-bajos
     Q_bias = 0.0  # Bias
-    ierr = 0.0  # Error integral acumulado
-    prev_err = 0.0  # Error anterior (para término derivativo)
     
-    # Inicializar listas
-    n = 600  # Número de muestras
-    T1 = [0.0] * n  # Temperatura en sensor 1
-    T2 = [0.0] * n  # Temperatura en sensor 2
-    Q1 = [0.0] * n  # Señal de control para calentador 1
-    SP1 = [40.0] * n  # Setpoint (temperatura deseada)
+    # Inicializar arreglos (preasignados una sola vez)
+    # float32 basta para la resolución del TCLab; los cálculos internos siguen en float64
+    t = np.arange(n, dtype=np.float32) * np.float32(sample_period)  # Eje de tiempo nominal (s)
+    T1 = np.zeros(n, dtype=np.float32)  # Temperatura en sensor 1
+    T2 = np.zeros(n, dtype=np.float32)  # Temperatura en sensor 2
+    Q1 = np.zeros(n, dtype=np.float32)  # Señal de control para calentador 1
+    SP1 = np.full(n, 40.0, dtype=np.float32)  # Setpoint (temperatura deseada)
+    
+    # Para almacenar los componentes del controlador
+    P_component = np.zeros(n, dtype=np.float32)  # Componente proporcional
+    I_component = np.zeros(n, dtype=np.float32)  # Componente integral
+    D_component = np.zeros(n, dtype=np.float32)  # Componente derivativo
+    t_actual = np.zeros(n)  # Tiempo real transcurrido en cada muestra (float64)
     
-    # Para almacenar los componentes del controladors
-    P_component = [0.0] * n  # Componente proporcional
-    I_component = [0.0] * n  # Componente integral
-    D_component = [0.0] * n  # Componente derivativo
+    # Elegir el paso del controlador una sola vez, fuera del lazo
+    step = PASOS[tipo_controlador]
+    use_I = tipo_controlador in ('PI', 'PID')  # Usa término integral
+    use_D = tipo_controlador in ('PD', 'PID')  # Usa término derivativo
+    
+    # Calentar el JIT fuera del lazo para no afectar el periodo de muestreo
+    # (antes de abrir la conexión: si falla o se interrumpe no queda abierta)
+    step(0.0, 0.0, 0.0, 0.0, 0.0, Kc, Ki, Kd, alpha, Q_bias)
     
     # Configurar la gráfica en modo interactivo
-    plt.ion()
+    if not HEADLESS:
+        plt.ion()
     
-    try:
-        print(f"Iniciando control {tipo_controlador}...")
+    # Crear la figura y las líneas una sola vez; luego solo se actualizan sus datos
+    # (sin pantalla y sin imagen por guardar no hace falta ninguna figura)
+    usa_figura = save_plot or not HEADLESS
+    if usa_figura:
+        componentes = [(P_component, 'g-', 'P')]
+        if use_D:
+            componentes.append((D_component, 'c-', 'D'))
+        if use_I:
+            componentes.append((I_component, 'y-', 'I'))
+        fig, ax1, ax2, series_temp, series_pwm = _crear_figura(
+            tipo_controlador, max(t[-1], sample_period), T1, T2, SP1, Q1, componentes)
+    
+    # Cada redibujado completo (cambio de límites, redimensionar, zoom/pan) vuelve a
+    # guardar el fondo estático y dibuja encima las líneas animadas
+    fondo = None
+    
+    def al_dibujar(event):
+        nonlocal fondo
+        fondo = fig.canvas.copy_from_bbox(fig.bbox)
+        for linea, _ in series_temp + series_pwm:
+            linea.axes.draw_artist(linea)
+    
+    # Dibujar una vez y guardar el fondo estático para el blitting
+    if not HEADLESS:
+        cid_dibujo = fig.canvas.mpl_connect('draw_event', al_dibujar)
+        plt.show(block=False)
+        plt.pause(0.1)
+        if fondo is None:
+            fig.canvas.draw()  # Forzar el primer dibujado si la ventana aún no lo hizo
+    
+    # Comunicación entre el hilo de control y la gráfica (hilo principal)
+    cola = queue.Queue(maxsize=1)  # Índice de la última muestra por graficar
+    detener = threading.Event()  # Señal para terminar el lazo de control
+    log_buf = []  # Mensajes de progreso con gráfica (se escriben al final)
+    muestras = 0  # Número de muestras tomadas (menor que n si se interrumpe)
+    
+    def lazo_control():
+        """
+        Lazo de muestreo y control cada sample_period segundos; se ejecuta en un
+        hilo aparte para que la gráfica nunca retrase el plazo de cada muestra
+        """
+        nonlocal muestras
+        ierr = 0.0  # Error integral acumulado
+        prev_T = 0.0  # Temperatura anterior (para término derivativo)
+        d_f = 0.0  # Derivativo filtrado
+        
+        # Enlazar como locales los nombres usados en cada muestra
+        leer_T1 = type(lab).T1.fget.__get__(lab)
+        leer_T2 = type(lab).T2.fget.__get__(lab)
+        set_Q1 = lab.Q1
+        paso = step
+        Kp_l, Ki_l, Kd_l, alpha_l, Q_bias_l = Kc, Ki, Kd, alpha, Q_bias
+        monotonic = time.monotonic
+        
+        t0 = monotonic()  # Referencia para los plazos de cada muestra
         for i in range(n):
-            # Leer temperatura actual
-            T1[i] = lab.T2
-            T2[i] = lab.T1
+            if detener.is_set():
+                break
             
-            # Cálculo del error
-            err = SP1[i] - T1[i]
+            # Plazo de esta muestra (no acumula el tiempo de lectura y cálculo)
+            deadline = t0 + (i + 1) * sample_period
             
-            # Componente proporcional - siempre se usa
-            P_component[i] = Kc * err
-            
-            # Componente integral - solo para PI y PID
-            if tipo_controlador in ['PI', 'PID']:
-                ierr += err
-                I_component[i] = (Kc / tauI) * ierr
-            
-            # Componente derivativo - para PD y PID
-            if tipo_controlador in ['PD', 'PID']:
-                deriv = (err - prev_err)
-                D_component[i] = Kc * tauD * deriv
-                prev_err = err
+            # Leer temperatura actual
+            t_actual[i] = monotonic() - t0
+            T = leer_T2()
+            T1[i] = T
+            T2[i] = leer_T1()
+            if i == 0:
+                prev_T = T  # Sin derivativo en la primera muestra
             
-            # Calcular la acción de control según el tipo de controlador
-            if tipo_controlador == 'PD':
-                Q1[i] = Q_bias + P_component[i] + D_component[i]
-            elif tipo_controlador == 'PI':
-                Q1[i] = Q_bias + P_component[i] + I_component[i]
-            else:  # PID
-                Q1[i] = Q_bias + P_component[i] + I_component[i] + D_component[i]
+            # Cálculo del error (en float64, igual que el integrador)
+            err = float(SP1[i]) - T
             
-            # Anti-windup
-            if Q1[i] >= 100:
-                Q1[i] = 100
-                if tipo_controlador in ['PI', 'PID']:
-                    ierr -= err  # Corregir el error integral acumulado
-            elif Q1[i] <= 0:
-                Q1[i] = 0
-                if tipo_controlador in ['PI', 'PID']:
-                    ierr -= err  # Corregir el error integral acumulado
+            # Paso del controlador (compilado)
+            (q, ierr, d_f,
+             P_component[i], I_component[i], D_component[i]) = paso(
+                err, T, prev_T, ierr, d_f, Kp_l, Ki_l, Kd_l, alpha_l, Q_bias_l)
+            prev_T = T
             
             # Aplicar señal de control
             if i > 10:
-                lab.Q1(Q1[i])
+                set_Q1(q)
             else:
-                Q1[i] = 0.0
-                lab.Q1(0)
+                q = 0.0
+                set_Q1(0)
+            Q1[i] = q
+            muestras = i + 1
             
-            # Para actualizar cada 10 segundos pero seguir muestreando cada segundo:
-            # 1. Solo actualizamos la gráfica cada 10 iteraciones
+            # Para actualizar cada 10 muestras pero seguir muestreando en cada periodo:
+            # 1. Solo registramos el progreso y publicamos un cuadro cada 10 iteraciones
             # 2. Pero seguimos tomando muestras y aplicando control cada iteración
+            if i % 10 == 0 or i == n-1:
+                if HEADLESS:
+                    # Sin gráfica el registro es la única salida: se muestra durante la
+                    # corrida, vaciando la salida solo cada 10 mensajes
+                    print(f"Iteración {i}: T1={T:.2f}°C, Q1={q:.2f}%", flush=False)
+                    if i % 100 == 0:
+                        sys.stdout.flush()
+                else:
+                    log_buf.append((i, T, q))
+                    _publicar(cola, i)
+            
+            # Esperar solo lo que falte para completar el periodo entre muestras
+            dt = deadline - monotonic()
+            if dt > 0:
+                detener.wait(dt)
+    
+    hilo = threading.Thread(target=lazo_control, daemon=True)
+    
+    # Abrir la conexión al final, justo antes del bloque que garantiza cerrarla
+    lab = tclab.TCLab()
+    
+    try:
+        print(f"Iniciando control {tipo_controlador}...")
+        hilo.start()
+        
+        # La gráfica se actualiza en el hilo principal con los cuadros que publica el lazo
+        while hilo.is_alive() or not cola.empty():
+            try:
+                i = cola.get(timeout=0.1)
+            except queue.Empty:
+                if not HEADLESS:
+                    fig.canvas.flush_events()  # Mantener la ventana respondiendo
+                continue
+            
+            # Graficar solo la ventana reciente y el historial submuestreado
+            idx = _indices_graficar(i, window)
             
-            if i % 10 == 0 or i == n-1:  # Actualizar gráfica cada 10 segundos o en la última iteración
-                # Gráfica de temperatura
-                plt.clf()
-                plt.subplot(2, 1, 1)
-                plt.plot(T1[:i+1], 'r-o', label='T1')
-                plt.plot(T2[:i+1], 'b-o', label='T2')
-                plt.plot(SP1[:i+1], 'k--', label='SP')
-                plt.ylabel('Temperatura (°C)')
-                plt.title(f'Control {tipo_controlador} de Temperatura')
-                plt.grid(True)
-                plt.legend()
-                
-                # Gráfica de PWM (Q1)
-                plt.subplot(2, 1, 2)
-                plt.plot(Q1[:i+1], 'b-', label='Q1 (PWM)')
-                
-                # También graficar los componentes del controlador
-                plt.plot(P_component[:i+1], 'g-', label='P')
-                
-                if tipo_controlador in ['PD', 'PID']:
-                    plt.plot(D_component[:i+1], 'c-', label='D')
-                    
-                if tipo_controlador in ['PI', 'PID']:
-                    plt.plot(I_component[:i+1], 'y-', label='I')
-                
-                plt.ylabel('PWM (%)')
-                plt.title('Señal de control Q1')
-                plt.xlabel('Tiempo (s)')
-                plt.grid(True)
-                plt.legend()
-                
-                plt.tight_layout()
-                plt.pause(0.05)  # Pequeña pausa necesaria para actualizar la gráfica
-                print(f"Iteración {i}: T1={T1[i]:.2f}°C, Q1={Q1[i]:.2f}%")
-                
-            time.sleep(1)  # Esperar un segundo entre muestras
+            # Reajustar el eje de temperatura (y redibujar el fondo) solo si los datos salen de los límites
+            if _ajustar_ylim(ax1, series_temp, idx):
+                fig.canvas.draw()  # al_dibujar actualiza el fondo
+            
+            # Restaurar el fondo y redibujar solo las líneas
+            fig.canvas.restore_region(fondo)
+            for linea, datos in series_temp + series_pwm:
+                linea.set_data(t[idx], datos[idx])
+                linea.axes.draw_artist(linea)
+            fig.canvas.blit(fig.bbox)
+            fig.canvas.flush_events()
         
     except KeyboardInterrupt:
         # En caso de interrupción, apagar y cerrar conexión
         print("\nDetención por usuario. Apagando calentadores y cerrando conexión.")
     
     finally:
+        # Detener el lazo de control antes de tocar la conexión
+        detener.set()
+        if hilo.is_alive():
+            hilo.join()
+        
         # Asegurar que siempre se apaguen los calentadores y se cierre la conexión
         lab.Q1(0)
         lab.Q2(0)
         lab.close()
         
-        # Guardar resultados
-        t = np.arange(n)
+        # Escribir de una vez el registro de progreso acumulado
+        if log_buf:
+            sys.stdout.write('\n'.join(f"Iteración {k}: T1={T1_k:.2f}°C, Q1={Q1_k:.2f}%"
+                                       for k, T1_k, Q1_k in log_buf) + '\n')
+        sys.stdout.flush()
         
-        # Crear DataFrame con los datos
+        # Columnas de datos a guardar
+        # (solo las muestras tomadas, así el tiempo sigue siendo creciente tras una interrupción)
+        k = muestras
         data = {
-            'Tiempo (s)': t,
-            'Setpoint (SP)': SP1,
-            'Temperatura (T1)': T1,
-            'Control PWM (Q1)': Q1,
-            'Componente P': P_component
+            'Tiempo (s)': t_actual[:k],
+            'Setpoint (SP)': SP1[:k],
+            'Temperatura (T1)': T1[:k],
+            'Control PWM (Q1)': Q1[:k],
+            'Componente P': P_component[:k]
         }
         
         # Añadir componentes según el controlador usado
-        if tipo_controlador in ['PD', 'PID']:
-            data['Componente D'] = D_component
-        if tipo_controlador in ['PI', 'PID']:
-            data['Componente I'] = I_component
-        
-        df = pd.DataFrame(data)
+        if use_D:
+            data['Componente D'] = D_component[:k]
+        if use_I:
+            data['Componente I'] = I_component[:k]
         
         # Generar timestamp para nombrar los archivos
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         
         # Guardar datos en CSV
-        csv_filename = f'registro_{tipo_controlador}_TempLab_{timestamp}.csv'
-        df.to_csv(csv_filename, index=False)
-        print(f"Datos guardados en '{csv_filename}'")
-        
-        # Crear gráfica final para guardar como imagen
-        plt.figure(figsize=(12, 8))
+        if save_csv:
+            csv_filename = f'registro_{tipo_controlador}_TempLab_{timestamp}.csv'
+            with open(csv_filename, 'wb', buffering=1 << 20) as f:
+                np.savetxt(f, np.column_stack(list(data.values())), delimiter=',',
+                           header=','.join(data), fmt='%.6g', comments='')
+            print(f"Datos guardados en '{csv_filename}'")
         
-        # Gráfica 1: Temperatura vs Tiempo
-        plt.subplot(3, 1, 1)
-        plt.plot(t, T1, 'r-', label='T1')
-        plt.plot(t, SP1, 'k--', label='SP')
-        plt.ylabel('Temperatura (°C)')
-        plt.title(f'Control {tipo_controlador} de Temperatura')
-        plt.grid(True)
-        plt.legend()
+        # Ya no se hace blitting: dejar de copiar el fondo en cada dibujado
+        if not HEADLESS:
+            fig.canvas.mpl_disconnect(cid_dibujo)
         
-        # Gráfica 2: Señal de control (PWM) vs Tiempo
-        plt.subplot(3, 1, 2)
-        plt.plot(t, Q1, 'b-', label='Q1 (PWM)')
-        plt.ylabel('PWM (%)')
-        plt.title('Señal de control Q1')
-        plt.grid(True)
-        plt.legend()
-        
-        # Gráfica 3: Componentes del controlador vs Tiempo
-        plt.subplot(3, 1, 3)
-        plt.plot(t, P_component, 'g-', label='P')
-        if tipo_controlador in ['PD', 'PID']:
-            plt.plot(t, D_component, 'c-', label='D')
-        if tipo_controlador in ['PI', 'PID']:
-            plt.plot(t, I_component, 'y-', label='I')
-        plt.ylabel('Magnitud de componentes (%)')
-        plt.xlabel('Tiempo (s)')
-        plt.title('Componentes del controlador')
-        plt.grid(True)
-        plt.legend()
+        # Pasada final sobre la figura en vivo con la traza completa
+        # (sin crear una segunda figura ni volver a graficar cada arreglo);
+        # solo si la figura se va a mostrar o guardar
+        if usa_figura:
+            # (solo las muestras tomadas, igual que en el CSV)
+            for linea, datos in series_temp + series_pwm:
+                linea.set_data(t[:k], datos[:k])
+                linea.set_animated(False)
+            if k > 0:
+                _ajustar_ylim(ax1, series_temp, slice(0, k))
+            
+            # Q1 conserva sus límites fijos (-10, 110); los componentes, mucho más grandes,
+            # pasan a un eje secundario que sí se autoescala para no aplastar a Q1
+            linea_Q1 = series_pwm[0][0]
+            ax3 = ax2.twinx()
+            for linea, datos in series_pwm[1:]:
+                linea.set_visible(False)
+                ax3.plot(t[:k], datos[:k], color=linea.get_color(),
+                         linestyle=linea.get_linestyle(), label=linea.get_label())
+            ax3.set_ylabel('Magnitud de componentes (%)')
+            ax2.legend(handles=[linea_Q1], loc='upper left')
+            ax3.legend(loc='upper right')
+            fig.set_size_inches(12, 8)  # Mismo tamaño que la gráfica final original
+            fig.tight_layout()
         
         # Guardar imagen
-        image_filename = f'grafico_{tipo_controlador}_TempLab_{timestamp}.png'
-        plt.tight_layout()
-        plt.savefig(image_filename)
-        print(f"Gráfica guardada en '{image_filename}'")
+        if save_plot:
+            image_filename = f'grafico_{tipo_controlador}_TempLab_{timestamp}.png'
+            fig.savefig(image_filename, dpi=100, bbox_inches='tight')
+            print(f"Gráfica guardada en '{image_filename}'")
         
-        plt.ioff()  # Desactivar modo interactivo
-        plt.show()  # Mostrar la gráfica final
+        if not HEADLESS:
+            plt.ioff()  # Desactivar modo interactivo
+            plt.show()  # Mostrar la gráfica final
         
-        return df  # Retornar el dataframe con los resultados
+        # Construir el DataFrame solo si quien llama lo va a usar
+        if retornar_df:
+            import pandas as pd
+            return pd.DataFrame(data)  # Retornar el dataframe con los resultados
 
 # Ejemplo de uso:
 if __name__ == "__main__":
@@ -219,11 +460,11 @@ if __name__ == "__main__":
     opcion = input("Ingresa el número de la opción deseada (1, 2 o 3): ")
     
     if opcion == '1':
-        ejecutar_control('PD')
+        ejecutar_control('PD', retornar_df=False)
     elif opcion == '2':
-        ejecutar_control('PI')
+        ejecutar_control('PI', retornar_df=False)
     elif opcion == '3':
-        ejecutar_control('PID')
+        ejecutar_control('PID', retornar_df=False)
     else:
         print("Opción no válida. Ejecutando PID por defecto.")
-        ejecutar_control('PID')
\ No newline at end of file
+        ejecutar_control('PID', retornar_df=False)
\ No newline at end of file